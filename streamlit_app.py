@@ -1,10 +1,27 @@
+import asyncio
+import html
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 from langchain_aws import ChatBedrock
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Dict, Any, List
 
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is the fallback
+    orjson = None
+
+try:
+    from spellchecker import SpellChecker
+except ImportError:  # optional; without it every check goes to LanguageTool
+    SpellChecker = None
+
 # --- CONFIG ---
 LT_API_KEY = st.secrets.get("LT_API_KEY")
 LT_USERNAME = st.secrets.get("LT_USERNAME")
@@ -19,7 +36,11 @@ st.set_page_config(
 )
 
 # --- CSS FOR UI ---
-st.markdown("""
+# Module-level constants: built once at import, not per rerun. They are
+# still st.markdown'ed every run because Streamlit drops elements that a
+# rerun does not re-emit, so a once-per-session sentinel would lose the
+# styles on the second interaction.
+_CSS = """
     <style>
     [data-testid="stSidebar"] {display: none;}
     .main-header {font-size: 2.5rem; color: #4A90E2; text-align: center; margin-bottom: 20px;}
@@ -43,7 +64,9 @@ st.markdown("""
         font-weight: bold;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+_HEADER = '<div class="main-header">📝 Essay Assessment Suport ver 0.1</div>'
 
 # --- DATA ---
 TOPICS = [
@@ -72,6 +95,7 @@ SAMPLE_REQUESTS = {
     ]
 }
 
+@st.cache_data(max_entries=32, show_spinner=False)
 def get_sample_essay_text_dummy(topic, request):
     return f"""This is a generated sample essay regarding {topic}.
     
@@ -85,7 +109,8 @@ Furthermore, in terms of development, the technology has shown profound results
 
 (This is a short placeholder sample to demonstrate the functionality)."""
 
-def get_sample_essay_text(topic, request):
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_sample_essay_text(topic):
     return f"""The International Atomic Energy Agency (IAEA), in collaboration with the Food and Agriculture Organization (FAO), has initiated and promoted several nuclear techniques to enhance food safety and protect public health worldwide. These techniques help detect contamination, prevent foodborne diseases, and support safe international food trade.
 
 One of the most significant contributions is food irradiation. This technique uses controlled doses of ionizing radiation to eliminate harmful microorganisms such as bacteria and parasites, delay spoilage, and extend shelf life without compromising nutritional quality. A major success story is Vietnam, where IAEA-supported irradiation facilities have enabled safer fruit exports by meeting international phytosanitary standards, reducing post-harvest losses and increasing market access.
@@ -100,145 +125,413 @@ Finally, the IAEA supports advanced nuclear-based laboratory methods, such as is
 
 In conclusion, IAEA-initiated nuclear techniques have played a vital role in improving food safety, reducing contamination, preventing fraud, and strengthening international food trade. Their successful application across many countries demonstrates how nuclear science contributes directly to public health and food security."""
 
-# --- CLASS: GRAMMAR CHECKER (LIGHTWEIGHT) ---
+# --- GRAMMAR CHECK (LIGHTWEIGHT) ---
+_WORD_RE = re.compile(r"[A-Za-z']+")
+# Number of locally-unknown tokens at which the LanguageTool call is made.
+SPELL_PREFILTER_THRESHOLD = 1
+
+@st.cache_resource(show_spinner=False)
+def _spell():
+    """Load the local spell-check dictionary once per process."""
+    return SpellChecker() if SpellChecker is not None else None
+
+def _looks_clean(text: str) -> bool:
+    """Fast local pre-scan: True when the essay has no suspicious tokens.
+
+    Skips the whole LanguageTool round-trip for well-written essays; any
+    unknown token (or a missing spellchecker install) falls through to
+    the full API check.
+    """
+    spell = _spell()
+    if spell is None:
+        return False
+    words = _WORD_RE.findall(text)
+    if not words:
+        return True
+    return len(spell.unknown(words)) < SPELL_PREFILTER_THRESHOLD
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False, hash_funcs={str: hash})
+def _lt_check(text: str, lang: str, api_key: str, username: str, api_url: str,
+              _session: requests.Session = None) -> List[Dict[str, Any]]:
+    """Call the LanguageTool API and return the list of errors.
+
+    Cached on (text, lang) so re-analyzing an unchanged essay skips the
+    network round-trip entirely. `_session` is excluded from the cache
+    key (leading underscore) and carries the keep-alive connection.
+    API failures propagate so they are never cached (Streamlit does not
+    cache raised exceptions) and a retry re-contacts the API.
+    """
+    if _looks_clean(text):
+        return []
+    data = {
+        "text": text,
+        "language": lang,
+        "username": username,
+        "apiKey": api_key,
+        "level": "picky"
+    }
+    response = (_session or requests).post(api_url, data=data, timeout=30)
+    response.raise_for_status()
+    result = response.json()
+
+    errors = []
+    for match in result.get("matches", []):
+        replacements = [r["value"] for r in match.get("replacements", [])][:3]
+        errors.append({
+            "offset": match["offset"],
+            "length": match["length"],
+            "replacements": replacements,
+            "bad_word": text[match["offset"]:match["offset"]+match["length"]]
+        })
+    return errors
+
 class SimpleLanguageToolChecker:
     def __init__(self, api_key: str, username: str, api_url: str):
         self.api_key = api_key
         self.username = username
         self.api_url = api_url
-    
+        # Keep-alive session so repeat checks skip the TCP/TLS handshake;
+        # the checker itself lives across reruns via st.cache_resource.
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
     def check_text(self, text: str) -> List[Dict[str, Any]]:
         """Call API and return list of errors."""
         try:
-            data = {
-                "text": text,
-                "language": "en-US",
-                "username": self.username,
-                "apiKey": self.api_key,
-                "level": "picky"
-            }
-            response = requests.post(self.api_url, data=data, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-            
-            errors = []
-            for match in result.get("matches", []):
-                replacements = [r["value"] for r in match.get("replacements", [])][:3]
-                errors.append({
-                    "offset": match["offset"],
-                    "length": match["length"],
-                    "replacements": replacements,
-                    "bad_word": text[match["offset"]:match["offset"]+match["length"]]
-                })
-            return errors
+            return _lt_check(text, "en-US", self.api_key, self.username, self.api_url,
+                             _session=self.session)
         except Exception:
             return []
 
 def render_simple_highlight(text: str, errors: List[Dict[str, Any]]) -> str:
-    """Chỉ bôi màu từ sai, không chèn tooltip."""
+    """Chỉ bôi màu từ sai, không chèn tooltip.
+
+    Single forward pass (O(n+k)) instead of re-slicing the whole essay
+    per error; segments are HTML-escaped before being put into the span.
+    Accumulates into one bytearray so long essays with many errors grow
+    a single buffer (bulk memcpy) instead of many small str objects.
+    """
     if not errors:
-        return text
-    
-    # Sort reverse to handle offsets correctly
-    errors.sort(key=lambda x: x["offset"], reverse=True)
-    
-    highlighted_text = text
-    for err in errors:
+        return html.escape(text).replace("\n", "<br>")
+
+    buf = bytearray()
+    cursor = 0
+    for err in sorted(errors, key=lambda x: x["offset"]):
         start = err["offset"]
         end = start + err["length"]
-        bad_segment = highlighted_text[start:end]
-        
-        # Simple HTML span class
-        replacement = f'<span class="grammar-error">{bad_segment}</span>'
-        highlighted_text = highlighted_text[:start] + replacement + highlighted_text[end:]
-        
-    return highlighted_text.replace("\n", "<br>")
+        if start < cursor:
+            continue  # skip overlapping matches
+        buf += html.escape(text[cursor:start]).encode('utf-8')
+        buf += b'<span class="grammar-error">'
+        buf += html.escape(text[start:end]).encode('utf-8')
+        buf += b'</span>'
+        cursor = end
+    buf += html.escape(text[cursor:]).encode('utf-8')
+
+    return buf.decode('utf-8').replace("\n", "<br>")
 
 # --- LLM SETUP & PROMPT ---
+@st.cache_resource(show_spinner=False)
 def get_llm():
-    try:
-        access_key = st.secrets.get("AWS_ACCESS_KEY_ID") 
-        secret_key = st.secrets.get("AWS_SECRET_ACCESS_KEY") 
-        
-        if not access_key or not secret_key:
-            st.error("AWS Credentials not found. Please check Streamlit Secrets.")
-            return None
-
-        llm = ChatBedrock(
-            aws_access_key_id=access_key,  # Đã thêm dấu phẩy
-            aws_secret_access_key=secret_key,
-            region_name="us-east-1",       # THÊM DÒNG NÀY (Bắt buộc)
-            provider="anthropic",
-            model_id="arn:aws:bedrock:us-east-1:605134429290:inference-profile/global.anthropic.claude-sonnet-4-5-20250929-v1:0",
-            temperature=0
-        )
-        return llm
-    except Exception as e:
-        st.error(f"Error initializing Bedrock: {e}")
+    """Build the ChatBedrock client once and reuse it across reruns.
+
+    Returns None when credentials are missing; the caller is responsible
+    for showing errors (cached functions should stay side-effect free).
+    """
+    access_key = st.secrets.get("AWS_ACCESS_KEY_ID")
+    secret_key = st.secrets.get("AWS_SECRET_ACCESS_KEY")
+
+    if not access_key or not secret_key:
         return None
 
-def build_assessment_prompt(topic, request, essay, check_ai, vietsub=False):
+    llm = ChatBedrock(
+        aws_access_key_id=access_key,  # Đã thêm dấu phẩy
+        aws_secret_access_key=secret_key,
+        region_name="us-east-1",       # THÊM DÒNG NÀY (Bắt buộc)
+        provider="anthropic",
+        model_id="arn:aws:bedrock:us-east-1:605134429290:inference-profile/global.anthropic.claude-sonnet-4-5-20250929-v1:0",
+        temperature=0,
+        # Latency-optimized inference only works over the Converse API;
+        # on the legacy InvokeModel path performance_config would end up
+        # in the Anthropic request body, which Bedrock rejects.
+        beta_use_converse_api=True,
+        performance_config={"latency": "optimized"}
+    )
+    return llm
+
+@st.cache_resource(show_spinner=False)
+def get_grammar_checker(api_key: str, username: str, api_url: str) -> SimpleLanguageToolChecker:
+    """Reuse one checker (and its HTTP connections) across reruns."""
+    return SimpleLanguageToolChecker(api_key, username, api_url)
+
+def _build_prompt_template(vietsub: bool, check_ai: bool) -> ChatPromptTemplate:
+    """Assemble one (language, check_ai) prompt variant.
+
+    The whole fixed rubric lives in the system message so Bedrock prompt
+    caching can reuse its KV cache across requests; the human message
+    carries only the runtime fields as {topic}/{request}/{essay}
+    template variables, filled in later via .partial().
+    """
     # Logic: Xây dựng chuỗi format output dựa trên các lựa chọn
     if vietsub:
-        system_role = "Bạn là chuyên gia đánh giá học thuật của IAEA. Hãy trả lời BẰNG TIẾNG VIỆT."
-        
-        # Xây dựng danh sách các mục output bắt buộc
-        output_structure = """
-            - Phản hồi yêu cầu: (1~2 câu đánh giá)
-            - Độ chính xác thông tin: (2~3 câu xác thực. In đậm nếu sử dụng các từ như **chính xác**/**không chính xác**)
-            - Phát triển ý tưởng: (1~2 câu. In đậm nếu sử dụng các từ như **Sâu sắc**/**Hời hợt**)
-            - Sự mạch lạc: (1~2 câu)
-            - Kết luận: (2~3 câu)
-            - Đánh giá tổng quan: (Chỉ trả về 1 trong các giá trị: Kém / Trung bình / Khá / Tốt / Xuất sắc)"""
-        
+        output_structure = """Phản hồi yêu cầu: (1~2 câu)
+Độ chính xác thông tin: (2~3 câu; in đậm **chính xác**/**không chính xác**)
+Phát triển ý tưởng: (1~2 câu; in đậm **Sâu sắc**/**Hời hợt**)
+Sự mạch lạc: (1~2 câu)
+Kết luận: (2~3 câu)
+Đánh giá tổng quan: (Kém / Trung bình / Khá / Tốt / Xuất sắc)"""
         if check_ai:
-            output_structure += "\n            - Phát hiện AI: (Trả về ước tính theo % từ 1 đến 100)"
-
-        prompt_template = ChatPromptTemplate.from_messages([
-            ("system", system_role),
-            ("human", f"""
-            **Chủ đề:** {topic}
-            **Yêu cầu:** {request}
-            **Bài làm:** {essay}
-            
-            ---
-            **HƯỚNG DẪN:**
-            Đánh giá bài luận và trả về kết quả theo ĐÚNG CẤU TRÚC sau (Không thay đổi tên mục):
-            {output_structure}
-            """)
-        ])
+            output_structure += "\nPhát hiện AI: (ước tính %, từ 1 đến 100)"
+
+        system_message = (
+            "Bạn là chuyên gia đánh giá học thuật của IAEA. Hãy trả lời BẰNG TIẾNG VIỆT. "
+            "Đánh giá bài luận theo ĐÚNG CẤU TRÚC sau (không thay đổi tên mục):\n" + output_structure
+        )
+        human_message = "**Chủ đề:** {topic}\n**Yêu cầu:** {request}\n**Bài làm:** {essay}"
     else:
-        system_role = "You are a strict academic evaluator for the IAEA."
-        
-        output_structure = """
-            - Task Response: (1~2 sentences)
-            - Information Accuracy: (2~3 sentences. Bold **accurate**, **inaccurate**)
-            - Idea Development: (1~2 sentences. Bold **Profound** or **Superficial**)
-            - Coherence: (1~2 sentences)
-            - Summary: (2~3 sentences)
-            - Final Evaluation: (Choose one: Poor / Average / Good / Excellent / Outstanding)"""
-        
+        output_structure = """Task Response: (1~2 sentences)
+Information Accuracy: (2~3 sentences; bold **accurate**/**inaccurate**)
+Idea Development: (1~2 sentences; bold **Profound**/**Superficial**)
+Coherence: (1~2 sentences)
+Summary: (2~3 sentences)
+Final Evaluation: (Poor / Average / Good / Excellent / Outstanding)"""
         if check_ai:
-             output_structure += "\n            - AI Plagiarism: (Estimated %, from 0 to 100)"
-
-        prompt_template = ChatPromptTemplate.from_messages([
-            ("system", system_role),
-            ("human", f"""
-            **Topic:** {topic}
-            **Request:** {request}
-            **Essay:** {essay}
-            
-            ---
-            **INSTRUCTIONS:**
-            Evaluate and provide output in the EXACT format below:
-            {output_structure}
-            """)
-        ])
-    return prompt_template
+            output_structure += "\nAI Plagiarism: (Estimated %, from 0 to 100)"
+
+        system_message = (
+            "You are a strict academic evaluator for the IAEA. "
+            "Evaluate the essay in EXACTLY this format (do not rename sections):\n" + output_structure
+        )
+        human_message = "**Topic:** {topic}\n**Request:** {request}\n**Essay:** {essay}"
+
+    return ChatPromptTemplate.from_messages([
+        ("system", system_message),
+        ("human", human_message)
+    ])
+
+# Build the four (vietsub x check_ai) variants once at import time instead
+# of re-parsing the template strings on every Analyze click.
+_PROMPT_TEMPLATES = {
+    (vietsub, check_ai): _build_prompt_template(vietsub, check_ai)
+    for vietsub in (False, True)
+    for check_ai in (False, True)
+}
+
+def build_assessment_prompt(topic, request, essay, check_ai, vietsub=False):
+    # Chọn template đã build sẵn và điền giá trị runtime
+    template = _PROMPT_TEMPLATES[(vietsub, check_ai)]
+    return template.partial(topic=topic, request=request, essay=essay)
+
+# Matches the section headers the prompt pins down (EN + VI), allowing
+# leading markdown decoration like "**", "-" or "#".
+SECTION_RE = re.compile(
+    r'^[\s\*\-#]*('
+    r'Task Response|Information Accuracy|Idea Development|Coherence|Summary|'
+    r'Final Evaluation|AI Plagiarism|'
+    r'Phản hồi yêu cầu|Độ chính xác thông tin|Phát triển ý tưởng|Sự mạch lạc|'
+    r'Kết luận|Đánh giá tổng quan|Phát hiện AI'
+    r')[\s\*]*:\s*(.*)$',
+    re.MULTILINE | re.IGNORECASE
+)
+
+# Map keywords for both languages
+_SECTION_MAP = {
+    "Task Response": ["Task Response", "Phản hồi yêu cầu"],
+    "Information Accuracy": ["Information Accuracy", "Độ chính xác thông tin"],
+    "Idea Development": ["Idea Development", "Phát triển ý tưởng"],
+    "Coherence": ["Coherence", "Sự mạch lạc"],
+    "Summary": ["Summary", "Kết luận"],
+    "Final Evaluation": ["Final Evaluation", "Đánh giá tổng quan"],
+    "AI Plagiarism": ["AI Plagiarism", "Phát hiện AI"]
+}
+# Lowercased keyword -> canonical section key, computed once at import so
+# no .lower() normalization happens per parsed response.
+_KW_TO_CANONICAL = {kw.lower(): canonical for canonical, kws in _SECTION_MAP.items() for kw in kws}
+
+def parse_llm_sections(response_text: str) -> Dict[str, str]:
+    """Split the LLM response into its named sections in one regex pass."""
+    parsed_data = {k: "" for k in _SECTION_MAP}
+    matches = list(SECTION_RE.finditer(response_text))
+    for i, m in enumerate(matches):
+        # IGNORECASE can match Unicode case-variants of the header names
+        # (e.g. dotted İ) whose .lower() is not in the table; skip those.
+        canonical = _KW_TO_CANONICAL.get(m.group(1).lower())
+        if canonical is None:
+            continue
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(response_text)
+        body = m.group(2) + " " + response_text[m.end():end]
+        parsed_data[canonical] = " ".join(body.split())
+    return parsed_data
+
+async def stream_chain(chain, placeholder):
+    """Stream the chain response into `placeholder` as tokens arrive, so
+    the user sees output after ~1s instead of waiting for the full
+    generation. Returns the complete response text.
+    """
+    buffer = ""
+    async for chunk in chain.astream({}):
+        buffer += chunk
+        placeholder.markdown(buffer + "▌")
+    placeholder.empty()
+    return buffer
+
+@st.cache_data(ttl=1800, show_spinner=False, hash_funcs={str: hash})
+def run_assessment(topic: str, request: str, essay: str, check_ai: bool, vietsub: bool,
+                   _llm, _placeholder) -> str:
+    """Build the prompt and run the LLM chain, streaming on a cache miss.
+
+    Cached on the actual analysis inputs, so re-clicking Analyze with an
+    unchanged essay (e.g. after flipping an unrelated widget) skips the
+    Bedrock round-trip entirely. Only the LLM response is cached here;
+    grammar results have their own cache in _lt_check, so a failed
+    grammar check is never frozen into this 30-minute entry. The client
+    object and the streaming placeholder carry a leading underscore to
+    stay out of the cache key.
+    """
+    prompt = build_assessment_prompt(topic, request, essay, check_ai, vietsub)
+    chain = prompt | _llm | StrOutputParser()
+    return asyncio.run(stream_chain(chain, _placeholder))
+
+# --- CLASS MODE (BATCH GRADING) ---
+# How many essays share one LLM call (row-marshalling) and how many of
+# those calls run against Bedrock in parallel.
+BATCH_ESSAY_COUNT = 5
+BATCH_MAX_CONCURRENCY = 8
+
+_BATCH_EVAL_KEYS = ("Task Response", "Information Accuracy", "Idea Development",
+                    "Coherence", "Summary", "Final Evaluation")
+
+def build_batched_prompt(topic, request, essays):
+    """Marshal several essays into one prompt asking for a JSON array."""
+    numbered = "\n\n".join(f"### Essay {i + 1}\n{essay}" for i, essay in enumerate(essays))
+    human_message = f"""**Topic:** {topic}
+**Request:** {request}
+
+Evaluate each essay below against the request. Respond ONLY with a JSON array,
+one object per essay in the same order, each with exactly these keys:
+"Task Response", "Information Accuracy", "Idea Development", "Coherence",
+"Summary", "Final Evaluation" (one of: Poor / Average / Good / Excellent / Outstanding).
+
+{numbered}"""
+    return [
+        ("system", "You are a strict academic evaluator for the IAEA."),
+        ("human", human_message)
+    ]
+
+def _parse_batch_response(response_text: str, expected: int) -> List[Dict[str, str]]:
+    """Parse the JSON array the batched prompt asks for, padding on failure."""
+    cleaned = re.sub(r'^```(?:json)?\s*|\s*```$', '', response_text.strip())
+    try:
+        # orjson parses in a tight Rust loop; json is the stdlib fallback
+        data = orjson.loads(cleaned) if orjson is not None else json.loads(cleaned)
+    except ValueError:  # both json.JSONDecodeError and orjson.JSONDecodeError
+        data = []
+    if not isinstance(data, list):
+        data = []
+    # The model can return bare strings instead of objects; coerce them
+    # to empty evaluations so the render loop can rely on dicts.
+    data = [d if isinstance(d, dict) else {} for d in data[:expected]]
+    data += [{} for _ in range(expected - len(data))]
+    return data
+
+def run_batch_assessment(llm, topic: str, request: str, essays: List[str]) -> List[Dict[str, str]]:
+    """Grade a list of essays in row-marshalled sub-batches.
+
+    Essays are grouped BATCH_ESSAY_COUNT per prompt to amortize the fixed
+    per-call overhead, and the sub-batch calls run in parallel through
+    abatch on the event loop (bounded by BATCH_MAX_CONCURRENCY), matching
+    the async style of the single-essay path. The client side is purely
+    I/O-bound, so this exploits Bedrock's per-account concurrency.
+    """
+    chain = llm | StrOutputParser()
+    chunks = [essays[i:i + BATCH_ESSAY_COUNT] for i in range(0, len(essays), BATCH_ESSAY_COUNT)]
+    prompts = [build_batched_prompt(topic, request, chunk) for chunk in chunks]
+    try:
+        responses = asyncio.run(
+            chain.abatch(prompts, config={"max_concurrency": BATCH_MAX_CONCURRENCY})
+        )
+    except RuntimeError:
+        # No usable event loop (e.g. one already running): thread-pooled fallback
+        responses = chain.batch(prompts, config={"max_concurrency": BATCH_MAX_CONCURRENCY})
+
+    evaluations = []
+    for chunk, response in zip(chunks, responses):
+        evaluations.extend(_parse_batch_response(response, len(chunk)))
+    return evaluations
+
+# --- RESULT FRAGMENTS ---
+# Rendering lives in fragments so a full-script rerun (e.g. toggling an
+# unrelated checkbox) replays the stored results without recomputation.
+@st.fragment
+def render_assessment_results(llm_response_text, check_ai, vietsub_mode):
+    st.divider()
+    st.subheader("Evaluation Results")
+
+    parsed_data = parse_llm_sections(llm_response_text)
+
+    def show_section(title, content_key):
+        content = parsed_data.get(content_key, "").strip()
+        # Clean leading markers
+        content = content.lstrip('*').lstrip('-').strip()
+        if content:
+            st.markdown(f"**{title}:** {content}")
+
+    if vietsub_mode:
+        show_section("Phản hồi yêu cầu", "Task Response")
+        show_section("Độ chính xác thông tin", "Information Accuracy")
+        show_section("Phát triển ý tưởng", "Idea Development")
+        show_section("Sự mạch lạc", "Coherence")
+        show_section("Kết luận", "Summary")
+    else:
+        show_section("Task Response", "Task Response")
+        show_section("Information Accuracy", "Information Accuracy")
+        show_section("Idea Development", "Idea Development")
+        show_section("Coherence", "Coherence")
+        show_section("Summary", "Summary")
+
+    # Final Eval & AI
+    final_eval = parsed_data.get("Final Evaluation", "").strip()
+    ai_score = parsed_data.get("AI Plagiarism", "").strip()
+
+    # Hiển thị Final Eval
+    if final_eval:
+        # Clean up if duplication occurs (LLM quirk)
+        final_eval = final_eval.lstrip('*').lstrip(":").strip()
+        st.markdown(f"### Final Evaluation: :blue[{final_eval}]")
+
+    # Hiển thị AI Box (Nếu có dữ liệu AI)
+    if check_ai and ai_score:
+        ai_score = ai_score.lstrip('*').lstrip(":").strip()
+        st.markdown(f'<div class="ai-score-box">⚠️ AI Detection: {ai_score}</div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_grammar_results(essay_text, grammar_errors):
+    st.divider()
+    st.subheader("Grammar Check")
+    if grammar_errors:
+        st.write(f"Found {len(grammar_errors)} issues:")
+
+        # Render Highlighted Text
+        html_view = render_simple_highlight(essay_text, grammar_errors)
+        st.markdown(
+            f'<div style="background-color: #f0f2f6; color: black; padding: 15px; border-radius: 5px; line-height: 1.6;">{html_view}</div>',
+            unsafe_allow_html=True
+        )
+
+        # Render List of Errors below
+        error_data = []
+        for e in grammar_errors:
+            sugg = ", ".join(e['replacements']) if e['replacements'] else "None"
+            error_data.append({"Error": e['bad_word'], "Suggestions": sugg})
+
+        st.table(error_data) # Simple, clean table
+    else:
+        st.success("No grammar errors found.")
 
 # --- MAIN ---
 def main():
-    st.markdown('<div class="main-header">📝 Essay Assessment Suport ver 0.1</div>', unsafe_allow_html=True)
+    st.markdown(_CSS, unsafe_allow_html=True)
+    st.markdown(_HEADER, unsafe_allow_html=True)
 
     # Inputss
     selected_topic = st.selectbox("Select Topic", TOPICS)
@@ -251,9 +544,12 @@ def main():
     if "essay_text_area" not in st.session_state:
         st.session_state["essay_text_area"] = ""
 
-    if st.button("Use Sample Essay"):
-        st.session_state["essay_text_area"] = get_sample_essay_text(selected_topic, final_request)
-        st.rerun()
+    def _use_sample_essay(topic):
+        st.session_state["essay_text_area"] = get_sample_essay_text(topic)
+
+    # on_click runs before the rerun renders, so no explicit st.rerun()
+    # is needed (which would have run the whole script twice per click).
+    st.button("Use Sample Essay", on_click=_use_sample_essay, args=(selected_topic,))
 
     essay_input = st.text_area("Student Submission:", height=300, key="essay_text_area")
 
@@ -270,128 +566,100 @@ def main():
             st.warning("Please provide request and essay.")
             return
 
-        # 1. LLM Analysis
-        llm = get_llm()
+        # 1. LLM Analysis + Grammar Check (run concurrently, both are I/O-bound)
+        llm = None
+        try:
+            llm = get_llm()
+        except Exception as e:
+            st.error(f"Error initializing Bedrock: {e}")
+        else:
+            if llm is None:
+                st.error("AWS Credentials not found. Please check Streamlit Secrets.")
+        checker = get_grammar_checker(LT_API_KEY, LT_USERNAME, LT_API_URL) if check_grammar else None
         llm_response_text = ""
-        if llm:
-            with st.spinner('Analyzing...'):
-                prompt = build_assessment_prompt(selected_topic, final_request, essay_input, check_ai, vietsub_mode)
-                chain = prompt | llm | StrOutputParser()
-                try:
-                    llm_response_text = chain.invoke({})
-                    print(llm_response_text)
-                except Exception as e:
-                    st.error(f"LLM Error: {e}")
-
-        # 2. Grammar Check (Lightweight)
         grammar_errors = []
-        if check_grammar:
+        if llm:
+            stream_placeholder = st.empty()  # raw tokens shown here while streaming
+            # Kick the grammar check off on a worker thread so it overlaps
+            # with the streamed LLM call; its result is never part of the
+            # run_assessment cache entry.
+            executor = grammar_future = None
+            if checker is not None:
+                executor = ThreadPoolExecutor(max_workers=1)
+                grammar_future = executor.submit(checker.check_text, essay_input)
+            try:
+                llm_response_text = run_assessment(
+                    selected_topic, final_request, essay_input, check_ai, vietsub_mode,
+                    _llm=llm, _placeholder=stream_placeholder
+                )
+            except Exception as e:
+                st.error(f"LLM Error: {e}")
+            if grammar_future is not None:
+                with st.spinner('Checking grammar...'):
+                    grammar_errors = grammar_future.result()
+                executor.shutdown()
+        elif checker is not None:
             with st.spinner('Checking grammar...'):
-                checker = SimpleLanguageToolChecker(LT_API_KEY, LT_USERNAME, LT_API_URL)
                 grammar_errors = checker.check_text(essay_input)
 
-        # 3. Display Results
-        st.divider()
-        st.subheader("Evaluation Results")
-        
-        # --- PARSING LOGIC ---
-        # Map keywords for both languages
-        section_map = {
-            "Task Response": ["Task Response", "Phản hồi yêu cầu"],
-            "Information Accuracy": ["Information Accuracy", "Độ chính xác thông tin"],
-            "Idea Development": ["Idea Development", "Phát triển ý tưởng"],
-            "Coherence": ["Coherence", "Sự mạch lạc"],
-            "Summary": ["Summary", "Kết luận"],
-            "Final Evaluation": ["Final Evaluation", "Đánh giá tổng quan"],
-            "AI Plagiarism": ["AI Plagiarism", "Phát hiện AI"]
+        # 3. Stash results so they survive unrelated widget reruns
+        st.session_state["analysis_results"] = {
+            "llm_text": llm_response_text,
+            "grammar_errors": grammar_errors,
+            "essay": essay_input,
+            "check_ai": check_ai,
+            "vietsub": vietsub_mode,
+            "check_grammar": check_grammar,
         }
-        
-        parsed_data = {k: "" for k in section_map}
-        current_section = None
-        
-        lines = llm_response_text.split('\n')
-        print(lines)
-        
-        for line in lines:
-            clean_line = line.strip()
-            if not clean_line: continue
-            
-            is_new_section = False
-            for section_key, keywords in section_map.items():
-                norm_line = clean_line.replace('*', '').replace('-', '').replace('#', '').strip().lower()
-                for kw in keywords:
-                    if norm_line.startswith(kw.lower()):
-                        current_section = section_key
-                        is_new_section = True
-                        if ':' in clean_line:
-                            content_part = clean_line.split(':', 1)[1].strip()
-                            if content_part:
-                                parsed_data[current_section] += content_part + " "
-                        break
-                if is_new_section: break
-            
-            if not is_new_section and current_section:
-                parsed_data[current_section] += clean_line + " "
-
-        # --- RENDER LLM OUTPUT ---
-        def show_section(title, content_key):
-            content = parsed_data.get(content_key, "").strip()
-            # Clean leading markers
-            content = content.lstrip('*').lstrip('-').strip()
-            if content:
-                st.markdown(f"**{title}:** {content}")
-
-        if vietsub_mode:
-            show_section("Phản hồi yêu cầu", "Task Response")
-            show_section("Độ chính xác thông tin", "Information Accuracy")
-            show_section("Phát triển ý tưởng", "Idea Development")
-            show_section("Sự mạch lạc", "Coherence")
-            show_section("Kết luận", "Summary")
-        else:
-            show_section("Task Response", "Task Response")
-            show_section("Information Accuracy", "Information Accuracy")
-            show_section("Idea Development", "Idea Development")
-            show_section("Coherence", "Coherence")
-            show_section("Summary", "Summary")
-
-        # Final Eval & AI
-        final_eval = parsed_data.get("Final Evaluation", "").strip()
-        ai_score = parsed_data.get("AI Plagiarism", "").strip()
-        
-        # Hiển thị Final Eval
-        if final_eval:
-            # Clean up if duplication occurs (LLM quirk)
-            final_eval = final_eval.lstrip('*').lstrip(":").strip()
-            st.markdown(f"### Final Evaluation: :blue[{final_eval}]")
-            
-        # Hiển thị AI Box (Nếu có dữ liệu AI)
-        if check_ai and ai_score:
-            ai_score = ai_score.lstrip('*').lstrip(":").strip()
-            st.markdown(f'<div class="ai-score-box">⚠️ AI Detection: {ai_score}</div>', unsafe_allow_html=True)
-
-        # 4. Show Grammar (Simple List)
-        if check_grammar:
-            st.divider()
-            st.subheader("Grammar Check")
-            if grammar_errors:
-                st.write(f"Found {len(grammar_errors)} issues:")
-                
-                # Render Highlighted Text
-                html_view = render_simple_highlight(essay_input, grammar_errors)
-                st.markdown(
-                    f'<div style="background-color: #f0f2f6; color: black; padding: 15px; border-radius: 5px; line-height: 1.6;">{html_view}</div>', 
-                    unsafe_allow_html=True
-                )
-                
-                # Render List of Errors below
-                error_data = []
-                for e in grammar_errors:
-                    sugg = ", ".join(e['replacements']) if e['replacements'] else "None"
-                    error_data.append({"Error": e['bad_word'], "Suggestions": sugg})
-                
-                st.table(error_data) # Simple, clean table
+
+    # 4. Display Results (fragments; rendered from session_state so they
+    # persist across reruns without re-invoking the LLM or LanguageTool)
+    analysis = st.session_state.get("analysis_results")
+    if analysis:
+        render_assessment_results(analysis["llm_text"], analysis["check_ai"], analysis["vietsub"])
+        if analysis["check_grammar"]:
+            render_grammar_results(analysis["essay"], analysis["grammar_errors"])
+
+    # 5. Class Mode: grade a whole set of submissions in batched LLM calls
+    st.divider()
+    with st.expander("👩‍🏫 Class Mode (Batch Grading)"):
+        st.caption("Paste multiple essays, separated by a line containing only `---`.")
+        batch_input = st.text_area("Student Submissions:", height=200, key="batch_essays")
+
+        if st.button("Grade All Essays", use_container_width=True):
+            essays = [e.strip() for e in re.split(r'(?m)^\s*---\s*$', batch_input) if e.strip()]
+            if not final_request or not essays:
+                st.warning("Please provide request and at least one essay.")
+                return
+
+            llm = None
+            try:
+                llm = get_llm()
+            except Exception as e:
+                st.error(f"Error initializing Bedrock: {e}")
             else:
-                st.success("No grammar errors found.")
+                if llm is None:
+                    st.error("AWS Credentials not found. Please check Streamlit Secrets.")
+            if not llm:
+                return
+
+            with st.spinner(f'Grading {len(essays)} essays...'):
+                try:
+                    evaluations = run_batch_assessment(llm, selected_topic, final_request, essays)
+                except Exception as e:
+                    st.error(f"LLM Error: {e}")
+                    evaluations = []
+
+            for i, evaluation in enumerate(evaluations, start=1):
+                st.markdown(f"#### Essay {i}")
+                if not evaluation:
+                    st.warning("Could not parse the evaluation for this essay.")
+                    continue
+                for key in _BATCH_EVAL_KEYS[:-1]:
+                    if evaluation.get(key):
+                        st.markdown(f"**{key}:** {evaluation[key]}")
+                if evaluation.get("Final Evaluation"):
+                    st.markdown(f"**Final Evaluation:** :blue[{evaluation['Final Evaluation']}]")
 
 if __name__ == "__main__":
     main()